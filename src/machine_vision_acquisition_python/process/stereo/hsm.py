@@ -124,8 +124,7 @@ class StereoProcessorHSM(StereoProcessor):
             disparity, thresh=self.max_disp, maxval=0, type=cv2.THRESH_TOZERO_INV
         )[1]
         # clip while keep inf
-        invalid = np.logical_or(disparity == np.inf, disparity != disparity)
-        disparity[invalid] = np.inf
+        disparity[~np.isfinite(disparity)] = np.inf
 
         # clip to ROI
         disparity = self.apply_roi_to_disparity(disparity)
@@ -47,8 +47,9 @@ class StereoProcessorOpenCVBM(StereoProcessor):
         left_remapped_gray = cv2.cvtColor(left_remapped, cv2.COLOR_BGR2GRAY)
         right_remapped_gray = cv2.cvtColor(right_remapped, cv2.COLOR_BGR2GRAY)
         disparity: cv2.Mat = self.bm.compute(left_remapped_gray, right_remapped_gray)
-        invalid = np.logical_or(disparity == np.inf, disparity != disparity)
-        disparity[invalid] = 0 if disparity.dtype == np.int16 else np.inf
+        if disparity.dtype.kind == "f":
+            # integer disparities (StereoBM's default CV_16S) can't be non-finite
+            disparity[~np.isfinite(disparity)] = np.inf
         # clip to ROI
         disparity = self.apply_roi_to_disparity(disparity)
         return disparity
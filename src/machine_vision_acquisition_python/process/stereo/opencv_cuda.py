@@ -0,0 +1,146 @@
+from typing import Optional, Tuple
+import numpy as np
+from numpy.typing import NDArray
+import cv2
+import logging
+from machine_vision_acquisition_python.calibration.shared import Calibration
+from machine_vision_acquisition_python.process.stereo.shared import StereoProcessor
+
+log = logging.getLogger(__name__)
+
+
+class StereoProcessorOpenCVCUDA(StereoProcessor):
+    """
+    Stereo processor that keeps the remap, disparity (semi-global matching) and reprojection pipeline on a CUDA device.
+
+    The *_gpu methods take and return cv2.cuda_GpuMat so intermediates never leave the device, use process_to_3d to
+    go from a host image pair to a host point cloud with a single upload and download per image.
+    Requires OpenCV built with CUDA (opencv-contrib cudastereo, cudawarping and cudaimgproc modules).
+
+    All device work (uploads, remap, matching, reprojection) is queued in order on self.stream, so each step can rely
+    on the previous one without the host waiting; the host only synchronises with the stream before downloading.
+    Note that uploads from ordinary (pageable) host memory still block the host until the copy is done.
+    """
+
+    def __init__(
+        self,
+        calibration_left: Calibration,
+        calibration_right: Calibration,
+        min_disparity=0,
+        max_disparity=256,
+    ) -> None:
+        super().__init__(calibration_left, calibration_right)
+        if not self.use_cuda:
+            raise RuntimeError(
+                "StereoProcessorOpenCVCUDA requires OpenCV built with CUDA and a CUDA device"
+            )
+        self.min_disp = min_disparity
+        self.max_disp = max_disparity
+        self.num_disparities = max_disparity - min_disparity
+        if self.num_disparities not in (64, 128, 256):
+            raise ValueError(
+                f"min_disparity and max_disparity must give 64, 128 or 256 disparities for CUDA SGM! got: {self.num_disparities}"
+            )
+        self.sgm: cv2.cuda.StereoSGM = cv2.cuda.createStereoSGM(
+            minDisparity=min_disparity, numDisparities=self.num_disparities
+        )
+        self.Q_32f = self.params.Q.astype(np.float32)
+        self.stream = cv2.cuda_Stream()
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state.pop("sgm", None)
+        state.pop("stream", None)
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self.sgm = cv2.cuda.createStereoSGM(
+            minDisparity=self.min_disp, numDisparities=self.num_disparities
+        )
+        self.stream = cv2.cuda_Stream()
+
+    def upload(self, image: cv2.Mat) -> cv2.cuda_GpuMat:
+        """Upload a host image on this processor's stream (only asynchronous for page-locked host memory)"""
+        gpu_image = cv2.cuda_GpuMat()
+        gpu_image.upload(image, self.stream)
+        return gpu_image
+
+    def remap_cuda(
+        self,
+        left: cv2.Mat,
+        right: cv2.Mat,
+        reuse_buffers: bool = False,
+        stream: Optional[cv2.cuda_Stream] = None,
+    ) -> Tuple[cv2.Mat, cv2.Mat]:
+        # Queue host remaps on this processor's stream rather than the default one
+        return super().remap_cuda(
+            left, right, reuse_buffers, self.stream if stream is None else stream
+        )
+
+    def calculate_disparity_gpu(
+        self, gpu_left_remapped: cv2.cuda_GpuMat, gpu_right_remapped: cv2.cuda_GpuMat
+    ) -> cv2.cuda_GpuMat:
+        """Returns a CV_16S disparity (4 fractional bits, same as cv2.StereoBM) on the device, not clipped to ROI"""
+        if gpu_left_remapped.channels() != 1:
+            gpu_left_remapped = cv2.cuda.cvtColor(
+                gpu_left_remapped, cv2.COLOR_BGR2GRAY, stream=self.stream
+            )
+            gpu_right_remapped = cv2.cuda.cvtColor(
+                gpu_right_remapped, cv2.COLOR_BGR2GRAY, stream=self.stream
+            )
+        gpu_disparity = cv2.cuda_GpuMat()
+        self.sgm.compute(
+            gpu_left_remapped, gpu_right_remapped, gpu_disparity, self.stream
+        )
+        return gpu_disparity
+
+    def calculate_disparity(self, left_remapped: cv2.Mat, right_remapped: cv2.Mat):
+        gpu_disparity = self.calculate_disparity_gpu(
+            self.upload(left_remapped), self.upload(right_remapped)
+        )
+        self.stream.waitForCompletion()
+        # clip to ROI
+        return self.apply_roi_to_disparity(gpu_disparity.download())
+
+    def reproject_gpu(self, gpu_disparity: cv2.cuda_GpuMat) -> cv2.cuda_GpuMat:
+        """
+        Reproject a CV_16S fixed point disparity to a 3-channel image of world space points in mm.
+
+        Invalid disparities (SGM marks these as (min_disparity - 1) * 16) and those <= min_disparity
+        would project to negative or infinite depths, so their points are set to (0, 0, 0).
+        """
+        gpu_disparity_px = gpu_disparity.convertTo(
+            cv2.CV_32F, alpha=1.0 / 16, stream=self.stream
+        )
+        gpu_points = cv2.cuda.reprojectImageTo3D(
+            gpu_disparity_px, self.Q_32f, dst_cn=3, stream=self.stream
+        )
+        # 255 where disparity <= min_disparity, then as an 8b mask
+        _, gpu_invalid = cv2.cuda.threshold(
+            gpu_disparity_px,
+            float(self.min_disp),
+            255,
+            cv2.THRESH_BINARY_INV,
+            stream=self.stream,
+        )
+        gpu_invalid = gpu_invalid.convertTo(cv2.CV_8U, stream=self.stream)
+        gpu_points.setTo((0, 0, 0, 0), gpu_invalid, self.stream)
+        return gpu_points
+
+    def process_to_3d(self, left: cv2.Mat, right: cv2.Mat) -> NDArray:
+        """
+        Remap, match and reproject a raw image pair entirely on the device, only downloading the final point cloud.
+
+        Returns an HxWx3 image of world space points, see points_px_to_3d_world_space for the coordinate system.
+        Points with an invalid disparity or outside the valid ROI are (0, 0, 0).
+        """
+        gpu_left, gpu_right = self.remap_gpu(
+            self.upload(left), self.upload(right), self.stream
+        )
+        gpu_points = self.reproject_gpu(
+            self.calculate_disparity_gpu(gpu_left, gpu_right)
+        )
+        self.stream.waitForCompletion()
+        # clip to ROI
+        return self.apply_roi_to_disparity(gpu_points.download())
@@ -1,11 +1,13 @@
 # This file contains stereo processing code
 from typing import Optional, Tuple, Union, List
+from concurrent.futures import ThreadPoolExecutor
 from cv2 import CALIB_ZERO_DISPARITY
 import numpy as np
 from numpy.typing import NDArray
 import cv2
 import cv2.fisheye
 import logging
+import weakref
 from machine_vision_acquisition_python.calibration.shared import (
     Calibration,
     CameraModel,
@@ -58,8 +60,38 @@ class StereoProcessor:
             self.calibration_left.image_height,
         )  # (width, height)
         self.camera_model: CameraModel = self.calibration_left.camera_model
+        self.use_cuda = _cuda_device_available()
+        # cv2.remap releases the GIL, so the left image is remapped on this thread while the right is on the caller's
+        self._remap_pool = ThreadPoolExecutor(max_workers=1)
+        # Output buffers for remap(..., reuse_buffers=True)
+        self._left_out: Optional[NDArray] = None
+        self._right_out: Optional[NDArray] = None
         self.init_stereo_params()
 
+    def __getstate__(self):
+        # Thread pools and GPU buffers can't be pickled (e.g. for multiprocessing), they are recreated on load.
+        # Remap output buffers are skipped as they are only scratch space.
+        state = self.__dict__.copy()
+        for key in (
+            "_remap_pool",
+            "_left_out",
+            "_right_out",
+            "gpu_map_left_1",
+            "gpu_map_left_2",
+            "gpu_map_right_1",
+            "gpu_map_right_2",
+        ):
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._remap_pool = ThreadPoolExecutor(max_workers=1)
+        self._left_out = None
+        self._right_out = None
+        if self.use_cuda:
+            self.init_cuda_maps()
+
     def init_opencv_model_params(self):
         # Generate stereo params
         self.params = StereoParams(
@@ -69,29 +101,14 @@ class StereoProcessor:
                 self.calibration_right.cameraMatrix,
                 self.calibration_right.distCoeffs,
                 self.image_size,
-                cv2.Rodrigues(self.R)[0],
+                self.R,
                 self.T,
                 flags=CALIB_ZERO_DISPARITY,
                 alpha=-1,
             )
         )
 
-        self.map_left_1, self.map_left_2 = cv2.initUndistortRectifyMap(
-            self.calibration_left.cameraMatrix,
-            self.calibration_left.distCoeffs,
-            self.params.R1,
-            self.params.P1,
-            self.image_size,
-            cv2.CV_16SC2,
-        )
-        self.map_right_1, self.map_right_2 = cv2.initUndistortRectifyMap(
-            self.calibration_right.cameraMatrix,
-            self.calibration_right.distCoeffs,
-            self.params.R2,
-            self.params.P2,
-            self.image_size,
-            cv2.CV_16SC2,
-        )
+        self.init_rectify_maps()
 
     def init_opencvfisheye_model_params(self):
         self.params = StereoParams(
@@ -101,28 +118,62 @@ class StereoProcessor:
                 self.calibration_right.cameraMatrix,
                 self.calibration_right.distCoeffs,
                 self.image_size,
-                cv2.Rodrigues(self.R)[0],
+                self.R,
                 self.T,
                 flags=CALIB_ZERO_DISPARITY,
             )
         )
 
-        self.map_left_1, self.map_left_2 = cv2.fisheye.initUndistortRectifyMap(
-            self.calibration_left.cameraMatrix,
-            self.calibration_left.distCoeffs,
-            self.params.R1,
-            self.params.P1,
-            self.image_size,
-            cv2.CV_16SC2,
-        )
-        self.map_right_1, self.map_right_2 = cv2.fisheye.initUndistortRectifyMap(
-            self.calibration_right.cameraMatrix,
-            self.calibration_right.distCoeffs,
-            self.params.R2,
-            self.params.P2,
-            self.image_size,
-            cv2.CV_16SC2,
-        )
+        self.init_rectify_maps()
+
+    def init_rectify_maps(self):
+        """Build the CV_16SC2 undistort-rectify maps for both cameras (shared with processors of identical calibrations)"""
+        # Keep the _RectifyMaps holders referenced, the shared cache only holds them weakly
+        self._rectify_maps = [
+            _init_undistort_rectify_map(
+                self.camera_model,
+                calibration.cameraMatrix,
+                calibration.distCoeffs,
+                R,
+                P,
+                self.image_size,
+                cv2.CV_16SC2,
+            )
+            for calibration, R, P in (
+                (self.calibration_left, self.params.R1, self.params.P1),
+                (self.calibration_right, self.params.R2, self.params.P2),
+            )
+        ]
+        self.map_left_1, self.map_left_2 = self._rectify_maps[0].maps
+        self.map_right_1, self.map_right_2 = self._rectify_maps[1].maps
+        if self.use_cuda:
+            self.init_cuda_maps()
+
+    def init_cuda_maps(self):
+        """Build float (CV_32FC1) rectification maps, as needed by cv2.cuda.remap, and upload them to the GPU"""
+        gpu_maps = []
+        for calibration, R, P in (
+            (self.calibration_left, self.params.R1, self.params.P1),
+            (self.calibration_right, self.params.R2, self.params.P2),
+        ):
+            for cpu_map in _init_undistort_rectify_map(
+                self.camera_model,
+                calibration.cameraMatrix,
+                calibration.distCoeffs,
+                R,
+                P,
+                self.image_size,
+                cv2.CV_32FC1,
+            ).maps:
+                gpu_map = cv2.cuda_GpuMat()
+                gpu_map.upload(cpu_map)
+                gpu_maps.append(gpu_map)
+        (
+            self.gpu_map_left_1,
+            self.gpu_map_left_2,
+            self.gpu_map_right_1,
+            self.gpu_map_right_2,
+        ) = gpu_maps
 
     def init_stereo_params(self):
         # https://answers.opencv.org/question/89968/how-to-derive-relative-r-and-t-from-camera-extrinsics/
@@ -132,8 +183,9 @@ class StereoProcessor:
 
         # Ensure that r1 and r2 are relative to each other
         self.R = np.matmul(np.linalg.inv(self.r1[0]), self.r2[0])
-        self.T = np.matmul(self.r1[0].T, self.calibration_right.tvec.T) - np.matmul(
-            self.r1[0].T, self.calibration_left.tvec.T
+        # r1.T @ t_right - r1.T @ t_left, factored into a single matmul
+        self.T = np.matmul(
+            self.r1[0].T, (self.calibration_right.tvec - self.calibration_left.tvec).T
         )
 
         if self.camera_model == CameraModel.OpenCV:
@@ -145,19 +197,121 @@ class StereoProcessor:
                 f"Camera model {self.camera_model} not supported (yet!)"
             )
 
-    def apply_roi_to_disparity(self, disparity: cv2.Mat) -> cv2.Mat:
-        masked_image = np.zeros(disparity.shape, disparity.dtype)
+        # Cache scalars used when converting disparity to depth. Disparities are measured in rectified images,
+        # so use the rectified focal length (as Q does), not the raw camera matrix's
+        self._baseline_mm = float(np.linalg.norm(self.T))
+        self._focallength_px = float(self.params.P1[0, 0])
+        # Cache Q split for points_px_to_3d_world_space: points @ Q[:, :3].T + Q[:, 3]
+        Q = self.params.Q.astype(np.float32)
+        self._Q_linear_T = np.ascontiguousarray(Q[:, :3].T)
+        self._Q_offset = Q[:, 3].copy()
+
+    def apply_roi_to_disparity(self, disparity: cv2.Mat, pad: bool = True) -> cv2.Mat:
+        """
+        Clip disparity to the valid ROI of the left camera.
+
+        If pad, the result has the same shape as the input with pixels outside the ROI set to 0.
+        Otherwise only the ROI is returned, as a view into disparity (no copy).
+        """
         roi = self.params.validROI1
         if roi is None or len(roi) != 4:
             raise ValueError("Invalid")
         x, y, w, h = roi
-        masked_image[y : y + h, x : x + w] = disparity[y : y + h, x : x + w]
-        return masked_image
+        cropped = disparity[y : y + h, x : x + w]
+        if not pad:
+            return cropped
+        if cropped.size == 0:
+            return np.zeros(disparity.shape, disparity.dtype)
+        return cv2.copyMakeBorder(
+            cropped,
+            y,
+            disparity.shape[0] - y - cropped.shape[0],
+            x,
+            disparity.shape[1] - x - cropped.shape[1],
+            cv2.BORDER_CONSTANT,
+            value=0,
+        )
+
+    def remap(
+        self, left: cv2.Mat, right: cv2.Mat, reuse_buffers: bool = False
+    ) -> Tuple[cv2.Mat, cv2.Mat]:
+        """
+        Undistort and rectify a left and right image.
+
+        If reuse_buffers, results are written into output buffers kept between calls to avoid a per-frame allocation.
+        *Note*: the returned images are then overwritten by the next reuse_buffers call, copy them if they must be kept!
+        """
+        if self.use_cuda:
+            return self.remap_cuda(left, right, reuse_buffers)
+        dst_left, dst_right = self.remap_output_buffers(left, right, reuse_buffers)
+        future_left = self._remap_pool.submit(
+            cv2.remap,
+            left,
+            self.map_left_1,
+            self.map_left_2,
+            cv2.INTER_LINEAR,
+            dst=dst_left,
+        )
+        right_remapped = cv2.remap(
+            right, self.map_right_1, self.map_right_2, cv2.INTER_LINEAR, dst=dst_right
+        )
+        return future_left.result(), right_remapped
+
+    def remap_output_buffers(
+        self, left: cv2.Mat, right: cv2.Mat, reuse_buffers: bool
+    ) -> Tuple[Optional[NDArray], Optional[NDArray]]:
+        """Return the dst arrays for remapping left and right: the kept output buffers if reuse_buffers, else None"""
+        if not reuse_buffers:
+            return None, None
+        self._left_out = _output_buffer(self._left_out, self.image_size, left)
+        self._right_out = _output_buffer(self._right_out, self.image_size, right)
+        return self._left_out, self._right_out
+
+    def remap_cuda(
+        self,
+        left: cv2.Mat,
+        right: cv2.Mat,
+        reuse_buffers: bool = False,
+        stream: Optional[cv2.cuda_Stream] = None,
+    ) -> Tuple[cv2.Mat, cv2.Mat]:
+        """
+        Remap both images on the GPU, returning them downloaded back to the host (see remap for reuse_buffers).
+
+        Uploads and remaps are queued on stream (the default stream if None), which is synchronised before downloading.
+        """
+        if stream is None:
+            stream = cv2.cuda.Stream_Null()
+        dst_left, dst_right = self.remap_output_buffers(left, right, reuse_buffers)
+        gpu_left = cv2.cuda_GpuMat()
+        gpu_left.upload(left, stream)
+        gpu_right = cv2.cuda_GpuMat()
+        gpu_right.upload(right, stream)
+        gpu_left, gpu_right = self.remap_gpu(gpu_left, gpu_right, stream)
+        stream.waitForCompletion()
+        return gpu_left.download(dst=dst_left), gpu_right.download(dst=dst_right)
 
-    def remap(self, left: cv2.Mat, right: cv2.Mat) -> Tuple[cv2.Mat, cv2.Mat]:
-        return cv2.remap(
-            left, self.map_left_1, self.map_left_2, cv2.INTER_LINEAR
-        ), cv2.remap(right, self.map_right_1, self.map_right_2, cv2.INTER_LINEAR)
+    def remap_gpu(
+        self,
+        gpu_left: cv2.cuda_GpuMat,
+        gpu_right: cv2.cuda_GpuMat,
+        stream: Optional[cv2.cuda_Stream] = None,
+    ) -> Tuple[cv2.cuda_GpuMat, cv2.cuda_GpuMat]:
+        """Queue remapping of both (already uploaded) images on stream (the default stream if None)"""
+        if stream is None:
+            stream = cv2.cuda.Stream_Null()
+        return cv2.cuda.remap(
+            gpu_left,
+            self.gpu_map_left_1,
+            self.gpu_map_left_2,
+            cv2.INTER_LINEAR,
+            stream=stream,
+        ), cv2.cuda.remap(
+            gpu_right,
+            self.gpu_map_right_1,
+            self.gpu_map_right_2,
+            cv2.INTER_LINEAR,
+            stream=stream,
+        )
 
     def calculate_disparity(self, left_remapped: cv2.Mat, right_remapped: cv2.Mat):
         """From two remapped images, return a single disparity image"""
@@ -166,57 +320,44 @@ class StereoProcessor:
     @property
     def baseline_mm(self):
         """Returns the stereo camera baseline in mm units (the norm of the t_vec)"""
-        return np.linalg.norm(self.T)
+        return self._baseline_mm
 
     @staticmethod
     def normalise_disparity_16b(disparity: cv2.Mat) -> cv2.Mat:
         """Given the processed disparity image (with invalid pixels set to np.inf), return a normalised 16b disparity map"""
-        # Normalise
-        invalid = np.logical_or(disparity == np.inf, disparity != disparity)
-        new_max_value = np.iinfo(np.uint16).max
-        old_max = disparity[~invalid].max()
-        if old_max <= 0:
-            log.debug("clipping old max < 0 to 1")
-            old_max = 1.0
-        log.debug(f"normalising disparity max from {old_max} to {new_max_value}")
-        disp_16b = (disparity / old_max * new_max_value).astype(np.uint16)  # type: ignore
-        return disp_16b
+        return _normalise_disparity(disparity, np.uint16)
 
     @staticmethod
     def normalise_disparity_8b(disparity: cv2.Mat) -> cv2.Mat:
         """Given the processed disparity image (with invalid pixels set to np.inf), return a normalised 8b disparity map"""
-        invalid = np.logical_or(disparity == np.inf, disparity != disparity)
-        new_max_value = np.iinfo(np.uint8).max
-        old_max = disparity[~invalid].max()
-        if old_max <= 0:
-            log.debug("clipping old max < 0 to 1")
-            old_max = 1.0
-        log.debug(f"normalising disparity max from {old_max} to {new_max_value}")
-        disp_8b = (disparity / old_max * new_max_value).astype(np.uint8)  # type: ignore
-        return disp_8b
+        return _normalise_disparity(disparity, np.uint8)
 
     @staticmethod
     def shift_disp_down(disparity: cv2.Mat) -> cv2.Mat:
         """Compress disparities towards 0 by removing empty space between 0 and first non-zero value"""
         # Shift back to within 0-255 range (min - max disp needs to be < 254)
-        if disparity.max() <= 0:
+        max_value = disparity.max()
+        if max_value <= 0:
             # nothing to do here, raise error?
             return disparity
-        non_zero_min = disparity[disparity != 0].min()
-        disparity_false = disparity - (non_zero_min + 1)
-        disparity_false[disparity_false < 0] = 0
+        non_zero_min = disparity.min(where=disparity != 0, initial=max_value)
+        offset = non_zero_min + 1
+        # max(d, offset) - offset == max(d - offset, 0) but cannot wrap for unsigned types
+        disparity_false = np.maximum(disparity, offset)
+        disparity_false -= offset
         return disparity_false
 
-    def disparity_to_depth_mm(self, disparity_value: Union[int, float]) -> float:
+    def disparity_to_depth_mm(
+        self, disparity_value: Union[int, float, NDArray]
+    ) -> Union[float, NDArray]:
         """
         Uses knowledge of camera calibration to project left hand disparity to depth in mm.
+        Also accepts an array of disparities, in which case an array of depths is returned.
         Source: https://docs.opencv.org/4.x/dd/d53/tutorial_py_depthmap.html
         """
-        focallength_px = self.calibration_left.focallength_px
         # doffs = self.calibration_right.cameraMatrix[0, 2] - self.calibration_left.cameraMatrix[0, 2]
         doffs = 0  # Because we use stereoRectify with the flag CALIB_ZERO_DISPARITY, image centers should be aligned
-        baseline_mm = np.linalg.norm(self.T)
-        return baseline_mm * focallength_px / (disparity_value + doffs)
+        return self._baseline_mm * self._focallength_px / (disparity_value + doffs)
 
     def points_px_to_3d_world_space(self, points_px: Union[NDArray, List[Tuple]]):
         """
@@ -232,34 +373,142 @@ class StereoProcessor:
 
         *Note*: negative Y values will mean upwards! This is because it follows the image convention of (0,0) being top left.
 
+        Projection uses the Q (disparity-to-depth) matrix from stereoRectify, i.e. the same maths as cv2.reprojectImageTo3D.
         Source: https://homepages.inf.ed.ac.uk/rbf/CVonline/LOCAL_COPIES/OWENS/LECT9/node2.html
         """
 
-        points_ndarray = (
-            _marshal_point_to_array(points_px).reshape(-1, 1, 3).astype(np.float32)
-        )
-        # Shape should be Nx3 not Nx1 by 3-channel
-        points_ndarray = np.squeeze(points_ndarray, axis=1)
-        if points_ndarray.shape[1] != 3:
+        points_ndarray = _marshal_point_to_array(points_px)
+        if points_ndarray.shape[-1] != 3:
             raise ValueError("Points input array must be Nx3 array")
-        result = []
-        # cache camera values locally
-        f_x = self.calibration_left.cameraMatrix[0, 0]
-        f_y = self.calibration_left.cameraMatrix[1, 1]
-        c_x = self.calibration_left.cameraMatrix[0, 2]
-        c_y = self.calibration_left.cameraMatrix[1, 2]
-        # TODO: This could probably be made a lot more efficient with matrix multiplication
-        for point in points_ndarray:
-            z = self.disparity_to_depth_mm(point[2])
-            x = (point[0] - c_x) / f_x * z
-            y = (point[1] - c_y) / f_y * z
-            result.append([x, y, z])
-        return np.array(result).astype(np.float32)
-
-
-def _marshal_point_to_array(point: Union[NDArray, List]):
-    if isinstance(point, list):
-        point = np.array(point).astype(np.float32)
-    if isinstance(point, Tuple):
-        point = np.array(point).astype(np.float32)
-    return point
+        # Nx3 rows (also accepts a single point or Nx1 by 3-channel input)
+        points_ndarray = points_ndarray.reshape(-1, 3)
+        # Reproject homogeneous (u, v, disparity, 1) rows through Q in a single matmul,
+        # the implicit 1 column is applied as a broadcast add rather than allocating an Nx4 copy
+        world_homogeneous = points_ndarray @ self._Q_linear_T
+        world_homogeneous += self._Q_offset
+        return world_homogeneous[:, :3] / world_homogeneous[:, 3:4]
+
+    def disparity_to_3d_world_space(
+        self, disparity: cv2.Mat, ddepth: int = cv2.CV_32F
+    ) -> cv2.Mat:
+        """
+        Converts a whole (left/main) disparity image to a 3-channel image of world space (x,y,z) points in mm.
+
+        ddepth may be cv2.CV_32F (default), cv2.CV_32S or cv2.CV_16S. CV_16S halves the output size but
+        rounds to whole mm and saturates beyond +/-32.767m.
+
+        See points_px_to_3d_world_space for the coordinate system used.
+        """
+        return cv2.reprojectImageTo3D(disparity, self.params.Q, ddepth=ddepth)
+
+
+def _marshal_point_to_array(point: Union[NDArray, List, Tuple]) -> NDArray:
+    """Return point(s) as a float32 array, without copying if already one"""
+    return np.asarray(point, dtype=np.float32)
+
+
+class _RectifyMaps:
+    """A pair of (read-only) rectification maps, held by processors and weakly by the shared cache"""
+
+    def __init__(self, map_1: NDArray, map_2: NDArray) -> None:
+        self.maps = (map_1, map_2)
+
+
+_rectify_maps_cache: "weakref.WeakValueDictionary[tuple, _RectifyMaps]" = (
+    weakref.WeakValueDictionary()
+)
+
+
+def _init_undistort_rectify_map(
+    camera_model: CameraModel,
+    cameraMatrix: NDArray,
+    distCoeffs: NDArray,
+    R: NDArray,
+    P: NDArray,
+    size: Tuple[int, int],
+    m1type: int,
+) -> _RectifyMaps:
+    """
+    Cached cv2.initUndistortRectifyMap (or cv2.fisheye equivalent for fisheye models).
+
+    Processors built from identical calibrations share the same maps rather than rebuilding them,
+    so the returned maps are read-only. The cache only holds maps weakly: once no caller keeps the
+    returned _RectifyMaps they are freed.
+    """
+    key = (
+        camera_model,
+        *(_hashable_array(array) for array in (cameraMatrix, distCoeffs, R, P)),
+        tuple(size),
+        m1type,
+    )
+    rectify_maps = _rectify_maps_cache.get(key)
+    if rectify_maps is not None:
+        return rectify_maps
+    if camera_model == CameraModel.OpenCVFisheye:
+        init_undistort_rectify_map = cv2.fisheye.initUndistortRectifyMap
+    else:
+        init_undistort_rectify_map = cv2.initUndistortRectifyMap
+    map_1, map_2 = init_undistort_rectify_map(
+        cameraMatrix, distCoeffs, R, P, size, m1type
+    )
+    # Align to 64 bytes (AVX-512 vector width) so SIMD remap kernels don't straddle cache lines on load
+    map_1, map_2 = _aligned(map_1), _aligned(map_2)
+    map_1.flags.writeable = False
+    map_2.flags.writeable = False
+    rectify_maps = _RectifyMaps(map_1, map_2)
+    _rectify_maps_cache[key] = rectify_maps
+    return rectify_maps
+
+
+def _aligned(array: NDArray, alignment: int = 64) -> NDArray:
+    """Return a copy of array whose data starts on an alignment byte boundary"""
+    buffer = np.empty(array.nbytes + alignment, np.uint8)
+    offset = -buffer.ctypes.data % alignment
+    aligned = np.ndarray(array.shape, array.dtype, buffer=buffer, offset=offset)
+    aligned[...] = array
+    return aligned
+
+
+def _hashable_array(array: NDArray) -> Tuple[Tuple[int, ...], bytes]:
+    array = np.ascontiguousarray(array, np.float64)
+    return array.shape, array.tobytes()
+
+
+def _output_buffer(
+    buffer: Optional[NDArray], image_size: Tuple[int, int], image: NDArray
+) -> NDArray:
+    """Return buffer if it can hold image remapped to image_size (width, height), otherwise a new one that can"""
+    shape = (image_size[1], image_size[0]) + image.shape[2:]
+    if buffer is None or buffer.shape != shape or buffer.dtype != image.dtype:
+        return np.empty(shape, image.dtype)
+    return buffer
+
+
+def _cuda_device_available() -> bool:
+    """True if this OpenCV build has CUDA support and a CUDA device is present"""
+    try:
+        return cv2.cuda.getCudaEnabledDeviceCount() > 0
+    except (AttributeError, cv2.error):
+        return False
+
+
+_OPENCV_DEPTHS = {np.uint8: cv2.CV_8U, np.uint16: cv2.CV_16U}
+
+
+def _normalise_disparity(disparity: cv2.Mat, dtype) -> cv2.Mat:
+    """
+    Scale the finite disparities so the largest maps to the max of integer dtype, invalid (non-finite) pixels become 0.
+    Values are rounded and saturated to the dtype range (so negative disparities become 0).
+    """
+    finite = np.isfinite(disparity).view(np.uint8)
+    new_max_value = np.iinfo(dtype).max
+    old_max = cv2.minMaxLoc(disparity, finite)[1]
+    if old_max <= 0:
+        log.debug("clipping old max < 0 to 1")
+        old_max = 1.0
+    log.debug(f"normalising disparity max from {old_max} to {new_max_value}")
+    # Scale and convert in one OpenCV pass with no float temporary, then copy only finite pixels onto zeros
+    disp_scaled = cv2.multiply(
+        disparity, new_max_value / old_max, dtype=_OPENCV_DEPTHS[dtype]
+    )
+    return cv2.copyTo(disp_scaled, finite, np.zeros(disparity.shape, dtype))
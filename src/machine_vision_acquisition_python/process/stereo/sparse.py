@@ -75,12 +75,10 @@ class SparseStereoProcessor(StereoProcessor):
         vertical_tolerance_px=10,
     ) -> float:
         """Given two points, return the horizontal disparity in pixel units"""
-        left_points = (
-            _marshal_point_to_array(left_point).reshape(-1, 1, 2).astype(np.float32)
+        left_points = _marshal_point_to_array(left_point).reshape(
+            -1, 1, 2
         )  # Make a 1xN/Nx1 2-channel CV_32FC2 array
-        right_points = (
-            _marshal_point_to_array(right_point).reshape(-1, 1, 2).astype(np.float32)
-        )
+        right_points = _marshal_point_to_array(right_point).reshape(-1, 1, 2)
 
         # Undistort points
         left_point_undistorted = self.undistort_image_points_l(left_points)[0][0]
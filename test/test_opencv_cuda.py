@@ -0,0 +1,51 @@
+from pathlib import Path
+import numpy as np
+import pytest
+from machine_vision_acquisition_python.calibration.libcalib import (
+    load_from_calibio_json,
+)
+from machine_vision_acquisition_python.process.stereo.opencv_cuda import (
+    StereoProcessorOpenCVCUDA,
+)
+from machine_vision_acquisition_python.process.stereo.shared import (
+    _cuda_device_available,
+)
+
+requires_cuda = pytest.mark.skipif(
+    not _cuda_device_available(), reason="requires OpenCV built with CUDA"
+)
+
+
+def _load_calibrations():
+    calib_path = Path(r"test/data/2022-12-22-BioEng-Calib.json")
+    return load_from_calibio_json(calib_path)
+
+
+@pytest.mark.skipif(_cuda_device_available(), reason="a CUDA device is available")
+def test_requires_cuda():
+    """
+    Tests that construction fails clearly without CUDA
+    """
+    calibs = _load_calibrations()
+    with pytest.raises(RuntimeError):
+        StereoProcessorOpenCVCUDA(calibs[0], calibs[1])
+
+
+@requires_cuda
+def test_process_to_3d():
+    """
+    Tests that the on-device pipeline returns only valid (positive depth) or zeroed points
+    """
+    calibs = _load_calibrations()
+    stereo = StereoProcessorOpenCVCUDA(calibs[0], calibs[1])
+    width, height = stereo.image_size
+    rng = np.random.default_rng(0)
+    left = rng.integers(0, 255, (height, width, 3), np.uint8)
+    right = np.roll(left, -32, axis=1)
+
+    points = stereo.process_to_3d(left, right)
+    assert points.shape == (height, width, 3)
+    assert np.isfinite(points).all()
+    valid = points.any(axis=2)
+    assert valid.any()
+    assert (points[valid][:, 2] > 0).all()
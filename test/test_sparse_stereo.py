@@ -1,4 +1,5 @@
 from pathlib import Path
+import cv2
 import numpy as np
 from machine_vision_acquisition_python.calibration.shared import Calibration
 from machine_vision_acquisition_python.calibration.interface import (
@@ -96,3 +97,63 @@ def test_sparse_stereo_general():
     assert np.array([241.31, -12.61, -7.55]) == pytest.approx(
         diff_3d_p1_p2_mm, 0.01
     )
+
+
+def test_points_and_image_reprojection_match():
+    """
+    Tests that sparse point projection agrees with dense disparity image reprojection
+    """
+    calib_path = Path(r"test/data/2022-12-22-BioEng-Calib.json")
+    calibs = load_from_calibio_json(calib_path)
+    from machine_vision_acquisition_python.process.stereo.sparse import (
+        SparseStereoProcessor,
+    )
+
+    stereo = SparseStereoProcessor(calibs[0], calibs[1])
+    disparity = np.full((20, 30), 195.58, np.float32)
+    points_3d_image = stereo.disparity_to_3d_world_space(disparity)
+    points_3d = stereo.points_px_to_3d_world_space([(29, 19, 195.58), (0, 0, 195.58)])
+    assert points_3d[0] == pytest.approx(points_3d_image[19, 29], 0.001)
+    assert points_3d[1] == pytest.approx(points_3d_image[0, 0], 0.001)
+
+    points_3d_image_16b = stereo.disparity_to_3d_world_space(disparity, cv2.CV_16S)
+    assert points_3d_image_16b.dtype == np.int16
+    assert np.abs(points_3d_image_16b - points_3d_image).max() <= 0.5
+
+
+def test_points_px_to_3d_world_space_shapes():
+    """
+    Tests that single points, Nx3 and Nx1 3-channel inputs are accepted and anything else is rejected
+    """
+    calib_path = Path(r"test/data/2022-12-22-BioEng-Calib.json")
+    calibs = load_from_calibio_json(calib_path)
+    from machine_vision_acquisition_python.process.stereo.sparse import (
+        SparseStereoProcessor,
+    )
+
+    stereo = SparseStereoProcessor(calibs[0], calibs[1])
+    point = (779, 851, 195.58)
+    expected = stereo.points_px_to_3d_world_space([point])
+    assert expected.shape == (1, 3)
+    assert stereo.points_px_to_3d_world_space(point) == pytest.approx(expected)
+    points_3_channel = np.array([point, point]).reshape(-1, 1, 3)
+    assert stereo.points_px_to_3d_world_space(points_3_channel).shape == (2, 3)
+    with pytest.raises(ValueError):
+        stereo.points_px_to_3d_world_space(np.zeros((3, 4)))
+
+
+def test_depth_and_point_projection_agree():
+    """
+    Tests that disparity_to_depth_mm and points_px_to_3d_world_space give the same depth for a disparity
+    """
+    calib_path = Path(r"test/data/2022-12-22-BioEng-Calib.json")
+    calibs = load_from_calibio_json(calib_path)
+    from machine_vision_acquisition_python.process.stereo.sparse import (
+        SparseStereoProcessor,
+    )
+
+    stereo = SparseStereoProcessor(calibs[0], calibs[1])
+    for disp_px in (50.0, 195.58, 250.0):
+        depth_mm = stereo.disparity_to_depth_mm(disp_px)
+        point_3d = stereo.points_px_to_3d_world_space((779, 851, disp_px))[0]
+        assert depth_mm == pytest.approx(point_3d[2], 1e-5)
@@ -0,0 +1,135 @@
+from pathlib import Path
+import gc
+import pickle
+import weakref
+import cv2
+import numpy as np
+from machine_vision_acquisition_python.calibration.libcalib import (
+    load_from_calibio_json,
+)
+from machine_vision_acquisition_python.process.stereo.shared import StereoProcessor
+
+
+def _load_stereo_processor() -> StereoProcessor:
+    calib_path = Path(r"test/data/2022-12-22-BioEng-Calib.json")
+    calibs = load_from_calibio_json(calib_path)
+    return StereoProcessor(calibs[0], calibs[1])
+
+
+def test_normalise_disparity():
+    """
+    Tests that finite disparities are scaled to the output range and invalid ones are zeroed
+    """
+    disparity = np.array([[0, 1.5, np.inf], [np.nan, 3, 2]], np.float32)
+
+    disp_8b = StereoProcessor.normalise_disparity_8b(disparity)
+    assert disp_8b.dtype == np.uint8
+    assert disp_8b.tolist() == [[0, 128, 0], [0, 255, 170]]
+
+    disp_16b = StereoProcessor.normalise_disparity_16b(disparity)
+    assert disp_16b.dtype == np.uint16
+    assert disp_16b.tolist() == [[0, 32768, 0], [0, 65535, 43690]]
+
+    # Fixed point (StereoBM) disparities, negative (invalid) values saturate to 0
+    disparity = np.array([[-16, 32, 64]], np.int16)
+    assert StereoProcessor.normalise_disparity_8b(disparity).tolist() == [[0, 128, 255]]
+
+    # Scaled by the largest value, not the largest magnitude
+    disparity = np.array([[-100, 10, 20]], np.int16)
+    assert StereoProcessor.normalise_disparity_8b(disparity).tolist() == [[0, 128, 255]]
+    disparity = np.array([[-100, 10, 20, np.inf]], np.float32)
+    assert StereoProcessor.normalise_disparity_16b(disparity).tolist() == [
+        [0, 32768, 65535, 0]
+    ]
+
+
+def test_shift_disp_down():
+    """
+    Tests that disparities are shifted towards 0 without underflowing
+    """
+    disparity = np.array([[0, 5, 7], [6, 0, 9]], np.uint8)
+    assert StereoProcessor.shift_disp_down(disparity).tolist() == [
+        [0, 0, 1],
+        [0, 0, 3],
+    ]
+
+    disparity = np.array([[0, 5.5, np.inf], [2, 0, 9]], np.float32)
+    assert StereoProcessor.shift_disp_down(disparity).tolist() == [
+        [0, 2.5, np.inf],
+        [0, 0, 6],
+    ]
+
+
+def test_remap():
+    """
+    Tests that remapping matches a plain cv2.remap of each image, including after pickling
+    """
+    stereo = _load_stereo_processor()
+    width, height = stereo.image_size
+    rng = np.random.default_rng(0)
+    left = rng.integers(0, 255, (height, width, 3), np.uint8)
+    right = rng.integers(0, 255, (height, width, 3), np.uint8)
+    expected_left = cv2.remap(
+        left, stereo.map_left_1, stereo.map_left_2, cv2.INTER_LINEAR
+    )
+    expected_right = cv2.remap(
+        right, stereo.map_right_1, stereo.map_right_2, cv2.INTER_LINEAR
+    )
+
+    for processor in (stereo, pickle.loads(pickle.dumps(stereo))):
+        left_remapped, right_remapped = processor.remap(left, right)
+        assert np.array_equal(left_remapped, expected_left)
+        assert np.array_equal(right_remapped, expected_right)
+
+    # Reused buffers are written in place on each call
+    left_buffer, right_buffer = stereo.remap(left, right, reuse_buffers=True)
+    assert np.array_equal(left_buffer, expected_left)
+    assert np.array_equal(right_buffer, expected_right)
+    expected_left, expected_right = stereo.remap(left // 2, right // 2)
+    left_remapped, right_remapped = stereo.remap(
+        left // 2, right // 2, reuse_buffers=True
+    )
+    assert left_remapped is left_buffer and right_remapped is right_buffer
+    assert np.array_equal(left_remapped, expected_left)
+    assert np.array_equal(right_remapped, expected_right)
+
+
+def test_apply_roi_to_disparity():
+    """
+    Tests that pixels outside the valid ROI are zeroed, or cropped away without padding
+    """
+    stereo = _load_stereo_processor()
+    width, height = stereo.image_size
+    x, y, w, h = stereo.params.validROI1
+    disparity = np.arange(width * height, dtype=np.float32).reshape(height, width)
+    expected = np.zeros_like(disparity)
+    expected[y : y + h, x : x + w] = disparity[y : y + h, x : x + w]
+
+    assert np.array_equal(stereo.apply_roi_to_disparity(disparity), expected)
+    cropped = stereo.apply_roi_to_disparity(disparity, pad=False)
+    assert np.array_equal(cropped, disparity[y : y + h, x : x + w])
+
+
+def test_rectify_maps_shared():
+    """
+    Tests that processors built from the same calibration share their (read-only, aligned) rectification maps
+    """
+    stereo_1 = _load_stereo_processor()
+    stereo_2 = _load_stereo_processor()
+    assert stereo_1.map_left_1 is stereo_2.map_left_1
+    assert stereo_1.map_right_2 is stereo_2.map_right_2
+    assert stereo_1.map_left_1 is not stereo_1.map_right_1
+    assert not stereo_1.map_left_1.flags.writeable
+    assert stereo_1.map_left_1.ctypes.data % 64 == 0
+    assert stereo_1.map_left_2.ctypes.data % 64 == 0
+
+
+def test_rectify_maps_freed():
+    """
+    Tests that shared rectification maps are not kept alive once no processor uses them
+    """
+    stereo = _load_stereo_processor()
+    map_left_1 = weakref.ref(stereo.map_left_1)
+    del stereo
+    gc.collect()
+    assert map_left_1() is None